@@ -5,11 +5,15 @@
 @summary:   Tests for Service plugin stories:
             LITPCDS-7704
 """
+from litp_cli_utils import CLIUtils
 from litp_generic_test import GenericTest, attr
 from redhat_cmd_utils import RHCmdUtils
 import test_constants
 from xml_utils import XMLUtils
 
+# litp_lsbservice_pkg_name in the TAF package-details.properties
+LSBSERVICE_PKG_NAME = "ERIClitplsbservice_CXP9031656"
+
 
 class Story7704(GenericTest):
     """
@@ -18,48 +22,106 @@ class Story7704(GenericTest):
         a node
     """
 
+    # preflight results shared by every test run in this process
+    preflight = None
+
     def setUp(self):
         """Run before every test"""
         super(Story7704, self).setUp()
         self.redhat = RHCmdUtils()
-        self.ms_node = self.get_management_node_filename()
-        self.mn_nodes = self.get_managed_node_filenames()
+        self.cli = CLIUtils()
         self.xml = XMLUtils()
+        self.xml_checks = []
+        if Story7704.preflight is None:
+            Story7704.preflight = self.run_preflight()
+        self.ms_node = Story7704.preflight["ms_node"]
+        self.mn_nodes = Story7704.preflight["mn_nodes"]
 
     def tearDown(self):
         """Run after every test"""
         super(Story7704, self).tearDown()
 
-    def export_validate_xml(self, path, file_name):
+    def run_preflight(self):
         """
-        Description
-            Exports the created item to xml file and Validates the xml file
+        Description:
+            Health gate run once per test process, it fails the test
+            early if the MS is not ready; it does not speed up setup.
+            The resolved nodes are reused by every later test
         Actions:
-            1: run export command on item path
-            2: validate the xml file
+            1. Resolve the node filenames
+            2. Ensure the litpd service is running on the MS
+            3. Ensure ERIClitplsbservice is installed on the MS
+        """
+        # 1. Resolve the node filenames
+        ms_node = self.get_management_node_filename()
+        mn_nodes = self.get_managed_node_filenames()
+
+        # 2. Ensure the litpd service is running on the MS
+        cmd = self.redhat.get_systemctl_status_cmd("litpd")
+        _, _, exit_code = self.run_command(ms_node, cmd)
+        self.assertEqual(0, exit_code, "litpd is not running")
+
+        # 3. Ensure ERIClitplsbservice is installed on the MS
+        cmd = "/bin/rpm -q {0}".format(LSBSERVICE_PKG_NAME)
+        _, _, exit_code = self.run_command(ms_node, cmd)
+        self.assertEqual(0, exit_code,
+                         "{0} is not installed".format(LSBSERVICE_PKG_NAME))
+
+        return {"ms_node": ms_node, "mn_nodes": mn_nodes}
+
+    def queue_xml_check(self, path, parent_path):
+        """
+        Description:
+            Queues an xml round-trip check for the created item, to be run
+            by verify_xml_checks
         """
-        # EXPORT CREATED PROFILE ITEM
-        self.execute_cli_export_cmd(self.ms_node, path, file_name)
-        # validate xml file and assert that it passes
-        cmd = self.xml.get_validate_xml_file_cmd(file_name)
-        stdout, stderr, exit_code = self.run_command(self.ms_node, cmd)
-        self.assertNotEqual([], stdout)
-        self.assertEqual(0, exit_code)
-        self.assertEqual([], stderr)
-
-    def load_xml(self, path, file_name):
+        self.xml_checks.append((path, parent_path))
+
+    def verify_xml_checks(self):
         """
         Description
-            Loads the created xml file and Validates the xml file
+            Runs the queued xml round-trip checks in one batch, each item
+            using its own xml file, and reports any failure against the
+            item that caused it
         Actions:
-            1. Loads the xml
-            2. Expects an error
+            1: run export command on each item path
+            2: validate each xml file
+            3: load each xml file and expect an ItemExistsError
         """
-        # this is done in each test to test the item with xml it an
-        # already exists error is expected
-        _, stderr, _ = self.execute_cli_load_cmd(
-            self.ms_node, path, file_name, expect_positive=False)
-        self.assertTrue(self.is_text_in_list("ItemExistsError ", stderr))
+        checks = []
+        errors = []
+
+        # 1: export created items
+        for path, parent_path in self.xml_checks:
+            file_name = "/tmp/xml_story7704{0}.xml".format(
+                path.replace("/", "_"))
+            self.del_file_after_run(self.ms_node, file_name)
+            cmd = self.cli.get_xml_export_cmd(path, file_name)
+            _, stderr, exit_code = self.run_command(self.ms_node, cmd)
+            if exit_code != 0 or stderr:
+                errors.append("{0}: xml export failed: {1}".format(
+                    path, stderr))
+            else:
+                checks.append((path, parent_path, file_name))
+        self.xml_checks = []
+
+        # 2: validate xml files
+        for path, _, file_name in checks:
+            cmd = self.xml.get_validate_xml_file_cmd(file_name)
+            stdout, stderr, exit_code = self.run_command(self.ms_node, cmd)
+            if not stdout or exit_code != 0 or stderr:
+                errors.append("{0}: xml validation failed: {1} {2}".format(
+                    path, stdout, stderr))
+
+        # 3: load xml files, an already exists error is expected
+        for path, parent_path, file_name in checks:
+            _, stderr, _ = self.execute_cli_load_cmd(
+                self.ms_node, parent_path, file_name, expect_positive=False)
+            if not self.is_text_in_list("ItemExistsError ", stderr):
+                errors.append("{0}: expected ItemExistsError on load: "
+                              "{1}".format(path, stderr))
+
+        self.assertEqual([], errors, "\n".join(errors))
 
     def is_service_not_running(self, service, node):
         """
@@ -112,17 +174,15 @@ class Story7704(GenericTest):
         # 1. Create service
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package, package_url)
 
         # 3. inherit package to ms
         self.execute_cli_inherit_cmd(
@@ -139,6 +199,9 @@ class Story7704(GenericTest):
                                 assert_running=True,
                                 su_root=False)
 
+        # verify queued xml tests
+        self.verify_xml_checks()
+
     @attr('all', 'revert', 'story7704', 'story7704_tc02')
     def test_02_p_ensure_service_on_one_node(self):
         """
@@ -182,17 +245,15 @@ class Story7704(GenericTest):
         # 1. Create service
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package, package_url)
 
         # 3. inherit service to node1
         self.execute_cli_inherit_cmd(
@@ -213,6 +274,9 @@ class Story7704(GenericTest):
                                 assert_running=True,
                                 su_root=False)
 
+        # verify queued xml tests
+        self.verify_xml_checks()
+
     @attr('all', 'revert', 'story7704', 'story7704_tc03')
     def test_03_p_ensure_service_on_two_nodes(self):
         """
@@ -261,17 +325,15 @@ class Story7704(GenericTest):
         # 1. Create service
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package, package_url)
 
         # 3. inherit service to node1
         self.execute_cli_inherit_cmd(
@@ -301,6 +363,9 @@ class Story7704(GenericTest):
                                 assert_running=True,
                                 su_root=False)
 
+        # verify queued xml tests
+        self.verify_xml_checks()
+
     @attr('all', 'revert', 'story7704', 'story7704_tc04')
     def test_04_p_ensure_service_removed(self):
         """
@@ -345,17 +410,15 @@ class Story7704(GenericTest):
         # 1. Create service
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package, package_url)
 
         # 3. inherit package to ms
         self.execute_cli_inherit_cmd(
@@ -372,6 +435,9 @@ class Story7704(GenericTest):
                                 assert_running=True,
                                 su_root=False)
 
+        # verify queued xml tests before the items are removed
+        self.verify_xml_checks()
+
         # 6. Remove the service
         self.execute_cli_remove_cmd(self.ms_node, service)
         self.execute_cli_remove_cmd(self.ms_node, ms_items_url)
@@ -421,17 +487,15 @@ class Story7704(GenericTest):
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
 
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. Create service
         self.execute_cli_create_cmd(self.ms_node, service2,
                                     "service", service_props)
 
-        # xml test
-        self.export_validate_xml(service2, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service2, service_url)
 
         # 3. inherit service to node1
         self.execute_cli_inherit_cmd(
@@ -450,6 +514,9 @@ class Story7704(GenericTest):
                         'Create plan failed: Duplicate service '
                         '"vsftpd" defined')
 
+        # verify queued xml tests
+        self.verify_xml_checks()
+
     @attr('all', 'revert', 'story7704', 'story7704_tc06')
     def test_06_n_create_disallowed_services(self):
         """
@@ -523,17 +590,15 @@ class Story7704(GenericTest):
         # 1. Create service
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package, package_url)
 
         # 3. inherit service to node1
         self.execute_cli_inherit_cmd(
@@ -552,6 +617,9 @@ class Story7704(GenericTest):
                         'Create plan failed: Service "sshd" is '
                         'managed by LITP')
 
+        # verify queued xml tests
+        self.verify_xml_checks()
+
     @attr('all', 'revert', 'story7704', 'story7704_tc08')
     def test_08_n_disallowed_service_on_ms_allowed_on_node(self):
         """
@@ -607,17 +675,15 @@ class Story7704(GenericTest):
         # 1. Create service
         self.execute_cli_create_cmd(self.ms_node, service,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service, "xml_story7704.xml")
-        self.load_xml(service_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service, service_url)
 
         # 2. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package, package_url)
 
         # 3. inherit package to ms
         self.execute_cli_inherit_cmd(
@@ -632,6 +698,9 @@ class Story7704(GenericTest):
                         'Create plan failed: Service "rabbitmq-server" '
                         'is managed by LITP')
 
+        # verify queued xml tests before the items are removed
+        self.verify_xml_checks()
+
         # 6. Remove the service
         self.execute_cli_remove_cmd(self.ms_node, ms_items_url)
         self.execute_cli_remove_cmd(self.ms_node, package)
@@ -650,17 +719,15 @@ class Story7704(GenericTest):
         # 7. Create service
         self.execute_cli_create_cmd(self.ms_node, service2,
                                     "service", service_props)
-        # xml test
-        self.export_validate_xml(service2, "xml_story7704.xml")
-        self.load_xml(service_url2, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(service2, service_url2)
 
         # 8. create a package
         self.execute_cli_create_cmd(
             self.ms_node, package2, "package", package_props)
 
-        # xml test
-        self.export_validate_xml(package2, "xml_story7704.xml")
-        self.load_xml(package_url, "xml_story7704.xml")
+        # queue xml test
+        self.queue_xml_check(package2, package_url)
 
         # 9. inherit service to node1
         self.execute_cli_inherit_cmd(
@@ -680,3 +747,6 @@ class Story7704(GenericTest):
         self.get_service_status(self.mn_nodes[0], app,
                                 assert_running=True,
                                 su_root=True)
+
+        # verify queued xml tests
+        self.verify_xml_checks()